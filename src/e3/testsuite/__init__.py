@@ -3,15 +3,18 @@
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import inspect
 import logging
 import os
+import queue
 import re
 import sys
 import tempfile
+import threading
 import traceback
-from typing import (Any, Callable, Dict, FrozenSet, IO, List, Optional,
-                    Pattern, TYPE_CHECKING, Tuple, Type, cast)
+from typing import (Any, Callable, Dict, FrozenSet, IO, List, Optional, Set,
+                    TYPE_CHECKING, Tuple, Type, cast)
 
 import yaml
 
@@ -27,9 +30,9 @@ from e3.testsuite.report.gaia import dump_gaia_report
 from e3.testsuite.report.display import summary_line
 from e3.testsuite.report.index import ReportIndex
 from e3.testsuite.report.xunit import dump_xunit_report
-from e3.testsuite.result import Log, TestResult, TestStatus
+from e3.testsuite.result import Log, ResultDumper, TestResult, TestStatus
 from e3.testsuite.testcase_finder import (ParsedTest, ProbingError, TestFinder,
-                                          YAMLTestFinder)
+                                          YAMLTestFinder, test_env_config_key)
 from e3.testsuite.utils import ColorConfig, isatty
 
 
@@ -39,6 +42,22 @@ if TYPE_CHECKING:  # no cover
 
 logger = logging.getLogger("testsuite")
 
+# Test statuses for which --show-error-output does not display logs
+_NO_ERROR_OUTPUT_STATUSES = frozenset({
+    TestStatus.PASS, TestStatus.XFAIL, TestStatus.XPASS, TestStatus.SKIP
+})
+
+# Test statuses that count for --max-consecutive-failures
+_FAILURE_STATUSES = frozenset({TestStatus.ERROR, TestStatus.FAIL})
+
+# Characters that have a special meaning in regular expressions
+_REGEXP_SPECIAL_CHARS = frozenset(".^$*+?{}[]\\|()")
+
+
+def _remove_prefix(s: str, prefix: str) -> str:
+    """Return ``s`` without ``prefix`` if it starts with it, or ``s`` as-is."""
+    return s[len(prefix):] if s.startswith(prefix) else s
+
 
 class TestAbort(Exception):
     """Raise this to abort silently the execution of a test fragment."""
@@ -124,6 +143,31 @@ class TestsuiteCore:
         self.result_tracebacks: Dict[str, List[str]] = {}
         self.testsuite_name = testsuite_name
 
+        self.test_env_cache_dir: Optional[str] = None
+        """
+        If not None, directory in which test finders can cache test
+        environments from one testsuite run to the other.
+        """
+
+        self.test_env_config: Optional[Dict[str, Any]] = None
+        """
+        Configuration used to interpret "test.yaml" files. Computed from the
+        global environment before looking for tests.
+        """
+
+        self.test_env_config_key: Optional[str] = None
+        """
+        Key for test_env_config in the test environment cache (see
+        test_env_cache_dir).
+        """
+
+        self._working_dir_prefix: Optional[str] = None
+        """
+        Prefix for the working directories of tests: testsuite working
+        directory followed by a directory separator. Computed when registering
+        the first test.
+        """
+
         self.aborted_too_many_failures = False
         """
         Whether the testsuite aborted because of too many consecutive test
@@ -178,6 +222,38 @@ class TestsuiteCore:
         """
         return os.path.join(self.output_dir, test_name + ".yaml")
 
+    def _start_result_writer(self) -> None:
+        """Start the thread that writes test results on disk."""
+        self._result_queue: queue.Queue[Optional[Tuple[str, str]]] = (
+            queue.Queue()
+        )
+        self._result_writer = threading.Thread(
+            target=self._write_results, daemon=True
+        )
+        self._result_writer.start()
+
+    def _stop_result_writer(self) -> None:
+        """Wait for all queued test results to be written on disk."""
+        self._result_queue.put(None)
+        self._result_writer.join()
+
+    def _write_results(self) -> None:
+        """Write on disk the test results that collect_result serializes.
+
+        This runs in a dedicated thread until it gets None from the queue.
+        """
+        while True:
+            item = self._result_queue.get()
+            if item is None:
+                break
+            filename, content = item
+            try:
+                with open(filename, "w") as fd:
+                    fd.write(content)
+            except Exception:
+                self.has_error = True
+                logger.exception("cannot write the result file %s", filename)
+
     def job_factory(self,
                     uid: str,
                     data: Any,
@@ -193,20 +269,15 @@ class TestsuiteCore:
         # When passing return values from predecessors, remove current test
         # name from the keys to ease referencing by user (the short fragment
         # name can then be used by user without knowing the full node id).
-        key_prefix = data[0].test_name + "."
-        key_prefix_len = len(key_prefix)
-
-        def filter_key(k: str) -> str:
-            if k.startswith(key_prefix):
-                return k[key_prefix_len:]
-            else:
-                return k
-
+        key_prefix = data[0]._fragment_prefix
         return TestFragment(
             uid,
             data[0],
             data[1],
-            {filter_key(k): self.return_values[k] for k in predecessors},
+            {
+                _remove_prefix(k, key_prefix): self.return_values[k]
+                for k in predecessors
+            },
             notify_end,
         )
 
@@ -295,6 +366,13 @@ class TestsuiteCore:
             " the environement that existed when this testsuite was run"
             " to produce a given testsuite report.",
         )
+        parser.add_argument(
+            "--dump-dag",
+            action="store_true",
+            help="Dump the graph of test fragments to execute in a file named"
+            " tests.dot, located in the output directory (see --output-dir)."
+            " This file uses the Graphviz DOT format.",
+        )
         parser.add_argument(
             "--xunit-output",
             dest="xunit_output",
@@ -367,6 +445,7 @@ class TestsuiteCore:
         d = os.path.abspath(self.main.args.output_dir)
         self.output_dir = os.path.join(d, "new")
         self.old_output_dir = os.path.join(d, "old")
+        self.test_env_cache_dir = os.path.join(d, "cache")
 
         if self.main.args.dev_temp:
             # Use a temporary directory for developers: make sure it is an
@@ -425,8 +504,9 @@ class TestsuiteCore:
                 self.has_error = True
         actions.check()
 
-        with open(os.path.join(self.output_dir, "tests.dot"), "w") as fd:
-            fd.write(actions.as_dot())
+        if self.main.args.dump_dag:
+            with open(os.path.join(self.output_dir, "tests.dot"), "w") as fd:
+                fd.write(actions.as_dot())
 
         # Run the tests. Note that when the testsuite aborts because of too
         # many consecutive test failures, we still want to produce a report and
@@ -434,11 +514,16 @@ class TestsuiteCore:
         # which e3's scheduler uses to abort the execution loop, but only in
         # such cases. In other words, let the exception propagates if it's the
         # user that interrupted the testsuite.
+        #
+        # In all cases, make sure queued test results are written on disk.
+        self._start_result_writer()
         try:
             self.scheduler.run(actions)
         except KeyboardInterrupt:
             if not self.aborted_too_many_failures:  # interactive-only
                 raise
+        finally:
+            self._stop_result_writer()
 
         self.report_index.write()
         self.dump_testsuite_result()
@@ -475,69 +560,148 @@ class TestsuiteCore:
         testcases: Dict[str, ParsedTest] = {}
         test_finders = self.test_finders
 
+        # The configuration used to interpret "test.yaml" files is the same for
+        # all testcases: compute it (and its cache key) only once.
+        self.test_env_config = Env().to_dict()
+        self.test_env_config_key = test_env_config_key(self.test_env_config)
+
         def add_testcase(test: ParsedTest) -> None:
             testcases[test.test_name] = test
 
-        def helper(spec: str) -> None:
-            pattern: Optional[Pattern[str]] = None
-
-            # If the given pattern is a directory, do not go through the whole
-            # tests subdirectory.
-            if os.path.isdir(spec):
-                root = spec
-            else:
-                root = self.test_dir
-                try:
-                    pattern = re.compile(spec)
-                except re.error as exc:
-                    logger.debug(
-                        "Test pattern is not a valid regexp, try to match it"
-                        " as-is: {}".format(exc)
-                    )
-                    pattern = re.compile(re.escape(spec))
-
-            # For each directory in the requested subdir, ask our test finders
-            # to probe for a testcase. Register matches.
-            for dirpath, dirnames, filenames in os.walk(
-                root, followlinks=True
-            ):
-                # If the directory name does not match the given pattern, skip
-                # it.
-                if pattern is not None and not pattern.search(dirpath):
+        # List of (dirpath, dirnames, filenames) for all directories to probe,
+        # and set of directory names in this list.
+        DirEntry = Tuple[str, List[str], List[str]]
+        candidates: List[DirEntry] = []
+        candidate_dirs: Set[str] = set()
+
+        # All directories in the tests subdirectory. Computed on demand, so
+        # that we walk it at most once even when there are several patterns.
+        test_dir_entries: List[DirEntry] = []
+
+        def walk(root: str) -> List[DirEntry]:
+            # When handling test data, we want to deal only with absolute
+            # paths. os.walk yields directory names that are joined to the
+            # root directory, so getting the absolute name for the root
+            # directory is enough.
+            return list(os.walk(os.path.abspath(root), followlinks=True))
+
+        def add_candidates(
+            entries: List[DirEntry],
+            predicate: Optional[Callable[[str], Any]] = None
+        ) -> None:
+            # Our test finders will probe candidates for testcases later on.
+            # If there is a predicate, only keep directories for which it
+            # returns true. Add each directory only once, even if several
+            # patterns match it.
+            for entry in entries:
+                dirpath = entry[0]
+                if dirpath in candidate_dirs or (
+                    predicate is not None and not predicate(dirpath)
+                ):
                     continue
+                candidate_dirs.add(dirpath)
+                candidates.append(entry)
+
+        def add_pattern_candidates(predicate: Callable[[str], Any]) -> None:
+            # Add candidates from the tests subdirectory that match the given
+            # predicate.
+            if not test_dir_entries:
+                test_dir_entries.extend(walk(self.test_dir))
+            add_candidates(test_dir_entries, predicate)
+
+        def probe(dirpath: str,
+                  dirnames: List[str],
+                  filenames: List[str]) -> List[ParsedTest]:
+            # The first test finder that has a match "wins"
+            for tf in test_finders:
+                test_or_list = tf.probe(self, dirpath, dirnames, filenames)
+                if isinstance(test_or_list, list):
+                    return test_or_list
+                elif test_or_list is not None:
+                    return [test_or_list]
+            return []
+
+        # If specific tests are requested, only look for them. Otherwise, just
+        # look in the tests subdirectory. Process patterns in the command-line
+        # order, so that the order of testcases follows it.
+        if sublist:
+            for spec in sublist:
+                # If the given pattern is a directory, do not go through the
+                # whole tests subdirectory.
+                if os.path.isdir(spec):
+                    add_candidates(walk(spec))
+
+                # Matching patterns with no regexp special character is just a
+                # substring search: do not bother going through the regexp
+                # engine for them.
+                elif not any(c in _REGEXP_SPECIAL_CHARS for c in spec):
+                    add_pattern_candidates(lambda dirpath: spec in dirpath)
 
-                # The first test finder that has a match "wins". When handling
-                # test data, we want to deal only with absolute paths, so get
-                # the absolute name now.
-                dirpath = os.path.abspath(dirpath)
-                for tf in test_finders:
+                else:
                     try:
-                        test_or_list = tf.probe(
-                            self, dirpath, dirnames, filenames
+                        pattern = re.compile(spec)
+                    except re.error as exc:
+                        logger.debug(
+                            "Test pattern is not a valid regexp, try to match"
+                            " it as-is: %s", exc
+                        )
+                        add_pattern_candidates(
+                            lambda dirpath: spec in dirpath
                         )
-                    except ProbingError as exc:
-                        self.has_error = True
-                        logger.error(str(exc))
-                        break
-                    if isinstance(test_or_list, list):
-                        for t in test_or_list:
-                            add_testcase(t)
-                        break
-                    elif test_or_list is not None:
-                        add_testcase(test_or_list)
-                        break
+                    else:
+                        add_pattern_candidates(pattern.search)
+        else:
+            add_candidates(walk(self.test_dir))
 
-        # If specific tests are requested, only look for them. Otherwise, just
-        # look in the tests subdirectory.
-        if sublist:
-            for s in sublist:
-                helper(s)
+        # Probing directories (for instance parsing "test.yaml" files) can
+        # take a lot of time for big testsuites, so use several threads to do
+        # it if all test finders and the test_name method support it.
+        # Register matches in the same order as candidates, so that the result
+        # does not depend on thread scheduling.
+        assert self.main.args
+        jobs = (
+            max(1, self.main.args.jobs)
+            if self.test_name_thread_safe
+            and all(tf.thread_safe for tf in test_finders)
+            else 1
+        )
+
+        def register(get_tests: Callable[[], List[ParsedTest]]) -> None:
+            try:
+                tests = get_tests()
+            except ProbingError as exc:
+                self.has_error = True
+                logger.error(str(exc))
+                return
+            for t in tests:
+                add_testcase(t)
+
+        # Test finders that are not thread safe may depend on thread-bound
+        # state: probe in the main thread when not probing in parallel.
+        if jobs == 1:
+            for c in candidates:
+                register(lambda: probe(*c))
         else:
-            helper(self.test_dir)
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(probe, *c) for c in candidates]
+                try:
+                    for future in futures:
+                        register(future.result)
+                except BaseException:
+                    # Do not wait for pending probes before propagating
+                    # unexpected errors (or KeyboardInterrupt).
+                    for f in futures:
+                        f.cancel()
+                    raise
 
         result = list(testcases.values())
-        logger.info("Found {} tests".format(len(result)))
-        logger.debug("tests:\n  " + "\n  ".join(t.test_dir for t in result))
+        logger.info("Found %s tests", len(result))
+
+        # The list of tests can be huge: build the message only when needed
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "tests:\n  %s", "\n  ".join(t.test_dir for t in result)
+            )
         return result
 
     def add_test(self, actions: DAG, parsed_test: ParsedTest) -> bool:
@@ -554,8 +718,13 @@ class TestsuiteCore:
         test_env["test_dir"] = parsed_test.test_dir
         test_env["test_name"] = test_name
 
-        assert isinstance(self.env.working_dir, str)
-        test_env["working_dir"] = os.path.join(self.env.working_dir, test_name)
+        # Working directories for tests are computed for each test: since the
+        # testsuite working directory is absolute and normalized, just
+        # concatenate test names to it.
+        if self._working_dir_prefix is None:
+            assert isinstance(self.env.working_dir, str)
+            self._working_dir_prefix = self.env.working_dir + os.path.sep
+        test_env["working_dir"] = self._working_dir_prefix + test_name
 
         # Fetch the test driver to use
         driver = parsed_test.driver_cls
@@ -573,11 +742,13 @@ class TestsuiteCore:
             instance.Style = self.Style
             instance.add_test(actions)
 
-        except Exception as e:
-            error_msg = str(e)
-            error_msg += "\nTraceback:\n"
-            error_msg += "\n".join(traceback.format_tb(sys.exc_info()[2]))
-            logger.error(error_msg)
+        except Exception:
+            # Let logging format the traceback
+            logger.error(
+                "cannot instantiate the driver for test '%s'",
+                test_name,
+                exc_info=True,
+            )
             return False
 
         return True
@@ -593,15 +764,12 @@ class TestsuiteCore:
         # Display test count for each status, but only for status that have
         # at least one test. Sort them by status value, to get consistent
         # order.
-        def sort_key(couple: Tuple[TestStatus, int]) -> Any:
-            status, _ = couple
-            return status.value
-        stats = sorted(
-            ((status, count)
-             for status, count in self.report_index.status_counters.items()
-             if count),
-            key=sort_key
-        )
+        counters = self.report_index.status_counters
+        stats = [
+            (status, counters[status])
+            for status in sorted(TestStatus, key=lambda s: s.value)
+            if counters[status]
+        ]
         for status, count in stats:
             lines.append('  {}{: <12}{} {}'.format(
                 status.color(self.colors), status.name,
@@ -636,6 +804,51 @@ class TestsuiteCore:
             # disappeared.
             assert result.status is not None
 
+            def indented_tb(tb: List[str]) -> str:
+                return "".join("  {}".format(line) for line in tb)
+
+            assert result.test_name not in self.report_index.entries, (
+                "cannot push twice results for {}"
+                "\nFirst push happened at:"
+                "\n{}"
+                "\nThis one happened at:"
+                "\n{}".format(
+                    result.test_name,
+                    indented_tb(self.result_tracebacks[result.test_name]),
+                    indented_tb(tb),
+                )
+            )
+            # Serialize the result right away: the test driver may keep
+            # mutating the objects it references (for instance its
+            # "test_env", which is also the result's "env") after pushing it.
+            # If that is not possible, replace it with an error result so that
+            # the report is still consistent with the result files on disk.
+            try:
+                content = yaml.dump(
+                    result, Dumper=ResultDumper, default_flow_style=False
+                )
+            except Exception:
+                self.has_error = True
+                logger.exception(
+                    "cannot write the result for %s", result.test_name
+                )
+                result = TestResult(
+                    result.test_name,
+                    status=TestStatus.ERROR,
+                    msg="cannot serialize the test result",
+                )
+                result.log += traceback.format_exc()
+                content = yaml.dump(
+                    result, Dumper=ResultDumper, default_flow_style=False
+                )
+
+            # Do not write the result on disk in the scheduler's thread: leave
+            # that to the result writer thread, so that I/O does not delay the
+            # scheduling of other jobs.
+            self._result_queue.put(
+                (self.test_result_filename(result.test_name), content)
+            )
+
             # Log the test result. If error output is requested and the test
             # failed unexpectedly, show the detailed logs.
             log_line = summary_line(result,
@@ -643,8 +856,7 @@ class TestsuiteCore:
                                     self.main.args.show_time_info)
             if (
                 self.main.args.show_error_output
-                and result.status not in (TestStatus.PASS, TestStatus.XFAIL,
-                                          TestStatus.XPASS, TestStatus.SKIP)
+                and result.status not in _NO_ERROR_OUTPUT_STATUSES
             ):
                 def format_log(log: Log) -> str:
                     return "\n" + str(log) + self.Style.RESET_ALL
@@ -655,28 +867,12 @@ class TestsuiteCore:
                     log_line += format_log(result.log)
             logger.info(log_line)
 
-            def indented_tb(tb: List[str]) -> str:
-                return "".join("  {}".format(line) for line in tb)
-
-            assert result.test_name not in self.report_index.entries, (
-                "cannot push twice results for {}"
-                "\nFirst push happened at:"
-                "\n{}"
-                "\nThis one happened at:"
-                "\n{}".format(
-                    result.test_name,
-                    indented_tb(self.result_tracebacks[result.test_name]),
-                    indented_tb(tb),
-                )
-            )
-            with open(self.test_result_filename(result.test_name), "w") as fd:
-                yaml.dump(result, fd)
             self.report_index.add_result(result)
             self.result_tracebacks[result.test_name] = tb
 
             # Update the number of consecutive failures, aborting the testsuite
             # if appropriate
-            if result.status in (TestStatus.ERROR, TestStatus.FAIL):
+            if result.status in _FAILURE_STATUSES:
                 consecutive_failures += 1
                 if (
                     max_consecutive_failures > 0
@@ -701,12 +897,17 @@ class TestsuiteCore:
         if os.path.isdir(self.output_dir):
             mv(self.output_dir, self.old_output_dir)
         mkdir(self.output_dir)
+        if self.test_env_cache_dir is not None:
+            mkdir(self.test_env_cache_dir)
 
         if self.main.args.dump_environ:
             with open(os.path.join(self.output_dir, "environ.sh"), "w") as f:
-                for var_name in sorted(os.environ):
-                    f.write("export {}={}\n".format(
-                        var_name, quote_arg(os.environ[var_name])))
+                f.write("".join(
+                    "export {}={}\n".format(
+                        var_name, quote_arg(os.environ[var_name])
+                    )
+                    for var_name in sorted(os.environ)
+                ))
 
     # Unlike the previous methods, the following ones are supposed to be
     # overriden.
@@ -746,9 +947,22 @@ class TestsuiteCore:
         This function can be overridden. By default it uses the name of the
         test directory. Note that the test name should be a valid filename (not
         dir seprators, or special characters such as ``:``, ...).
+
+        Test finders call this while probing directories, which can happen in
+        several threads at the same time if test_name_thread_safe returns
+        true.
         """
         raise NotImplementedError
 
+    @property
+    def test_name_thread_safe(self) -> bool:
+        """Return whether ``test_name`` can be called from several threads.
+
+        Directories are probed in parallel only if this returns true (see
+        TestFinder.thread_safe).
+        """
+        return False
+
     @property
     def test_finders(self) -> List[TestFinder]:
         """Return test finders to probe tests directories."""
@@ -850,6 +1064,12 @@ class Testsuite(TestsuiteCore):
         # double underscores.
         return result.replace("\\", "/").rstrip("/").replace("/", "__")
 
+    @property
+    def test_name_thread_safe(self) -> bool:
+        # Subclasses that override test_name have to opt in for parallel
+        # probing.
+        return type(self).test_name is Testsuite.test_name
+
     @property
     def test_finders(self) -> List[TestFinder]:
         return [YAMLTestFinder()]
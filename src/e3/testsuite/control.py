@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from enum import Enum
 import os.path
+from types import CodeType
 from typing import Any, Dict, List, NoReturn, Optional
 
 from e3.testsuite import logger
@@ -9,6 +10,24 @@ from e3.testsuite.driver import TestDriver
 from e3.testsuite.optfileparser import OptFileParse
 
 
+# Cache for compiled control entry conditions, indexed by source code. Many
+# testcases usually share the same conditions, so this avoids compiling them
+# over and over.
+_condition_cache: Dict[str, CodeType] = {}
+
+
+def _compile_condition(source: str) -> CodeType:
+    """Return the compiled code for the given control entry condition.
+
+    :param source: Python expression for the condition.
+    """
+    result = _condition_cache.get(source)
+    if result is None:
+        result = compile(source, "<control>", "eval")
+        _condition_cache[source] = result
+    return result
+
+
 class TestControlKind(Enum):
     """Control how to run (or not!) testcases."""
 
@@ -87,16 +106,17 @@ class YAMLTestControlCreator(TestControlCreator):
             )
 
         # Read the configuration from the test environment's "control" key, if
-        # present.
-        default = TestControl()
-        try:
-            control = driver.test_env["control"]
-        except KeyError:
-            return default
-
-        # Variables available to entry conditions
-        condition_env = dict(self.condition_env)
-        condition_env["env"] = driver.env
+        # present. Most testcases have no such entry: return a default
+        # TestControl right away for them. Note that we do not share a single
+        # default instance, as test drivers are free to modify theirs.
+        if "control" not in driver.test_env:
+            return TestControl()
+        control = driver.test_env["control"]
+
+        # Variables available to entry conditions. Note that eval() inserts
+        # "__builtins__" in the globals it is given: create a new dict so that
+        # self.condition_env is left untouched.
+        condition_env = {**self.condition_env, "env": driver.env}
 
         # First validate the whole control structure, and only then interpret
         # it, for the same reason an language interpreter checks the syntax
@@ -138,7 +158,7 @@ class YAMLTestControlCreator(TestControlCreator):
 
             # Evaluate the condition
             try:
-                cond = eval(entry[1], condition_env)
+                cond = eval(_compile_condition(entry[1]), condition_env)
             except Exception as exc:
                 error("invalid condition ({}): {}"
                       .format(type(exc).__name__, exc))
@@ -157,7 +177,7 @@ class YAMLTestControlCreator(TestControlCreator):
                     TestControlKind.XFAIL: (False, True),
                 }[kind]
                 return TestControl(message, skip, xfail)
-        return default
+        return TestControl()
 
 
 class AdaCoreLegacyTestControlCreator(TestControlCreator):
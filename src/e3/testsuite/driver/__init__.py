@@ -10,6 +10,7 @@ import e3.collection.dag
 import e3.env
 
 from e3.testsuite.result import TestResult
+from e3.testsuite.utils import DummyColors
 
 
 class TestDriver(object, metaclass=abc.ABCMeta):
@@ -18,6 +19,11 @@ class TestDriver(object, metaclass=abc.ABCMeta):
     All drivers declared in a testsuite should inherit from this class
     """
 
+    # The testsuite sets these when instantiating drivers. They can also be
+    # colorama.Style and colorama.Fore, but we don't have type hints for them.
+    Style: DummyColors
+    Fore: DummyColors
+
     def __init__(self, env: e3.env.BaseEnv, test_env: Dict[str, Any]) -> None:
         """Initialize a TestDriver instance.
 
@@ -42,6 +48,9 @@ class TestDriver(object, metaclass=abc.ABCMeta):
         self.test_env: Dict[str, Any] = test_env
         self.test_name: str = test_env["test_name"]
 
+        # Prefix for the IDs of the DAG vertices that this driver creates
+        self._fragment_prefix: str = self.test_name + "."
+
         # Initialize test result
         self.result: TestResult = TestResult(
             name=self.test_name, env=self.test_env
@@ -88,13 +97,13 @@ class TestDriver(object, metaclass=abc.ABCMeta):
             this one.
         """
         if after is not None:
-            after = [self.test_name + "." + k for k in after]
+            after = [self._fragment_prefix + k for k in after]
 
         if fun is None:
             fun = getattr(self, name)
 
         dag.update_vertex(
-            vertex_id=self.test_name + "." + name,
+            vertex_id=self._fragment_prefix + name,
             data=(self, fun),
             predecessors=after,
             enable_checks=False
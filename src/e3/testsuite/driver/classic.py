@@ -74,11 +74,6 @@ class ClassicTestDriver(TestDriver):
     * have support for automatic XFAIL/SKIP test results.
     """
 
-    # These can also be colorama.Style and colorama.Fore, but we don't have
-    # type hints for them.
-    Style: DummyColors
-    Fore: DummyColors
-
     # Depending on the default encoding, this can be either a log of strings or
     # a log of bytes.
     output: Log
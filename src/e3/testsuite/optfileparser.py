@@ -192,7 +192,7 @@ class OptFileParse:
             self.__enable_note = True
 
         if cmd != "required" and self.__match(tags):
-            logger.debug("match: " + cmd + ", tags=" + "%s" % tags)
+            logger.debug("match: %s, tags=%s", cmd, tags)
             if self.__is_overidable(cmd):
                 self.__matches[cmd] = (tags, arg, self.__is_all(tags))
 
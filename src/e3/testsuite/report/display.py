@@ -49,21 +49,33 @@ def summary_line(result: TestResult,
     else:
         time_info = ''
 
+    # This is called for each test result, so when colors are disabled, do
+    # not bother formatting empty color codes.
+    if not colors.enabled:
+        line = '{:<8} {:>6} {}'.format(
+            result.status.name, time_info, result.test_name
+        )
+        if result.msg:
+            line += ': ' + result.msg
+        return line
+
+    style = colors.Style
+    reset = style.RESET_ALL
+    dim = style.DIM
     line = '{}{:<8}{} {}{:>6}{} {}{}{}'.format(
         result.status.color(colors),
         result.status.name,
-        colors.Style.RESET_ALL,
+        reset,
 
-        colors.Style.DIM,
+        dim,
         time_info,
-        colors.Style.RESET_ALL,
+        reset,
 
-        colors.Style.BRIGHT,
+        style.BRIGHT,
         result.test_name,
-        colors.Style.RESET_ALL)
+        reset)
     if result.msg:
-        line += ': {}{}{}'.format(colors.Style.DIM, result.msg,
-                                  colors.Style.RESET_ALL)
+        line += ': {}{}{}'.format(dim, result.msg, reset)
     return line
 
 
@@ -12,6 +12,14 @@ import yaml
 from e3.testsuite.utils import ColorConfig
 
 
+# Test results are dumped once per testcase, so use libyaml's emitter when it
+# is available: this is much faster than the pure Python one.
+try:
+    from yaml import CSafeDumper as ResultDumper
+except ImportError:  # no cover
+    from yaml import SafeDumper as ResultDumper  # type: ignore
+
+
 class TestStatus(Enum):
     """Testcase execution status."""
 
@@ -64,18 +72,23 @@ class TestStatus(Enum):
 
         This returns an empty string if colors are disabled.
         """
-        Fore = colors.Fore
-        Style = colors.Style
-        return {
-            'PASS': Fore.GREEN,
-            'FAIL': Fore.RED,
-            'XFAIL': Fore.CYAN,
-            'XPASS': Fore.YELLOW,
-            'VERIFY': Fore.YELLOW,
-            'SKIP': Style.DIM,
-            'NOT_APPLICABLE': Style.DIM,
-            'ERROR': Fore.RED + Style.BRIGHT,
-        }[self.name]
+        # This is called for each test result: compute the color codes for
+        # all statuses only once per ColorConfig instance.
+        table = colors.status_colors
+        if not table:
+            Fore = colors.Fore
+            Style = colors.Style
+            table.update({
+                TestStatus.PASS: Fore.GREEN,
+                TestStatus.FAIL: Fore.RED,
+                TestStatus.XFAIL: Fore.CYAN,
+                TestStatus.XPASS: Fore.YELLOW,
+                TestStatus.VERIFY: Fore.YELLOW,
+                TestStatus.SKIP: Style.DIM,
+                TestStatus.NOT_APPLICABLE: Style.DIM,
+                TestStatus.ERROR: Fore.RED + Style.BRIGHT,
+            })
+        return table[self]
 
 
 class FailureReason(Enum):
@@ -303,6 +316,11 @@ def _log_representer(dumper: Any, data: Log) -> Any:
 
 
 yaml.add_representer(Log, _log_representer)
+yaml.add_representer(Log, _log_representer, Dumper=ResultDumper)
+
+# yaml.YAMLObject subclasses register their representer only for the default
+# (unsafe) Dumper: explicitly register TestResult for ResultDumper as well.
+yaml.add_representer(TestResult, TestResult.to_yaml, Dumper=ResultDumper)
 
 
 _test_status_tag = "!e3.testsuite.result.TestStatus"
@@ -342,7 +360,13 @@ def _failure_reason_representer(dumper: Any, data: FailureReason) -> Any:
 
 yaml.SafeLoader.add_constructor(_test_status_tag, _test_status_constructor)
 yaml.add_representer(TestStatus, _test_status_representer)
+yaml.add_representer(
+    TestStatus, _test_status_representer, Dumper=ResultDumper
+)
 yaml.SafeLoader.add_constructor(
     _failure_reason_tag, _failure_reason_constructor
 )
 yaml.add_representer(FailureReason, _failure_reason_representer)
+yaml.add_representer(
+    FailureReason, _failure_reason_representer, Dumper=ResultDumper
+)
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 import collections.abc
+import hashlib
+import logging
 import os.path
+import pickle
 import re
-from typing import List, Optional, TYPE_CHECKING, Type, Union
+import tempfile
+from typing import Any, Dict, List, Optional, TYPE_CHECKING, Type, Union
 
 from e3.env import Env
 import e3.yaml
@@ -14,6 +18,28 @@ if TYPE_CHECKING:  # no cover
     from e3.testsuite import TestsuiteCore
 
 
+logger = logging.getLogger("testsuite")
+
+
+# Env().to_dict() entries that describe a specific testsuite run (command-line
+# options, ...) rather than the testing environment. "test.yaml" files are not
+# expected to depend on them, so ignore them in test environment cache keys.
+_CACHE_KEY_IGNORED_ENTRIES = frozenset({"cwd", "environ", "main_options"})
+
+
+def test_env_config_key(config: Dict[str, Any]) -> str:
+    """Return the test environment cache key for the given configuration.
+
+    :param config: Configuration passed to e3.yaml.load_with_config to
+        interpret "test.yaml" files.
+    """
+    return repr(sorted(
+        (name, value)
+        for name, value in config.items()
+        if name not in _CACHE_KEY_IGNORED_ENTRIES
+    ))
+
+
 class ParsedTest:
     """Basic information to instantiate a test driver."""
 
@@ -50,6 +76,17 @@ class ProbingError(Exception):
 class TestFinder:
     """Interface for objects that find testcases in the tests subdirectory."""
 
+    @property
+    def thread_safe(self) -> bool:
+        """Return whether ``probe`` can be called from several threads.
+
+        When all test finders are thread safe, and if the testsuite's
+        ``test_name`` method is thread safe too (see
+        ``TestsuiteCore.test_name_thread_safe``), the testsuite probes
+        directories in parallel.
+        """
+        return False
+
     def probe(self,
               testsuite: TestsuiteCore,
               dirpath: str,
@@ -77,6 +114,91 @@ class YAMLTestFinder(TestFinder):
     driver whose name corresponds to the associated string value.
     """
 
+    @property
+    def thread_safe(self) -> bool:
+        # Subclasses that override probe/load_test_env have to opt in for
+        # parallel probing.
+        cls = type(self)
+        return (
+            cls.probe is YAMLTestFinder.probe
+            and cls.load_test_env is YAMLTestFinder.load_test_env
+        )
+
+    def load_test_env(self, testsuite: TestsuiteCore, yaml_file: str) -> Any:
+        """Load the given "test.yaml" file.
+
+        If the testsuite has a cache directory for test environments, reuse
+        the result of a previous parsing as long as the file content is
+        unchanged, and as long as the environment used to interpret it is
+        unchanged.
+
+        Raise a e3.yaml.YamlError if the file is invalid.
+
+        :param testsuite: Testsuite instance that is looking for testcases.
+        :param yaml_file: Name of the file to load.
+        """
+        config = testsuite.test_env_config
+        config_key = testsuite.test_env_config_key
+        if config is None:
+            config = Env().to_dict()
+            config_key = test_env_config_key(config)
+        cache_dir = testsuite.test_env_cache_dir
+        if cache_dir is None:
+            return e3.yaml.load_with_config(yaml_file, config)
+
+        # There is one cache entry per "test.yaml" file. Each entry stores the
+        # key for the parsing result it contains, so that entries for modified
+        # files are just overwritten. File metadata (modification time, size)
+        # is not reliable enough to detect modifications, so use a hash of the
+        # file content instead: computing it is cheap compared to parsing.
+        yaml_file = os.path.abspath(yaml_file)
+        with open(yaml_file, "rb") as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+        key = "{}:{}".format(content_hash, config_key)
+        cache_file = os.path.join(
+            cache_dir,
+            hashlib.sha1(yaml_file.encode("utf-8")).hexdigest() + ".pickle",
+        )
+
+        # Consider invalid cache entries as cache misses
+        try:
+            with open(cache_file, "rb") as f:
+                cached_key, test_env = pickle.load(f)
+            if cached_key == key:
+                return test_env
+        except Exception:
+            pass
+
+        test_env = e3.yaml.load_with_config(yaml_file, config)
+
+        # Several threads may probe in parallel tests that share the same
+        # "test.yaml" file: write to a temporary file first, then rename it,
+        # so that readers never see incomplete cache entries.
+        #
+        # The cache is just an optimization: do not let errors while writing
+        # it stop the testsuite.
+        tmp_filename = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=cache_dir, suffix=".tmp", delete=False
+            ) as tmp_file:
+                tmp_filename = tmp_file.name
+                pickle.dump((key, test_env), tmp_file)
+            os.replace(tmp_filename, cache_file)
+        except Exception as exc:
+            logger.debug(
+                "cannot write the test environment cache entry for %s: %s",
+                yaml_file,
+                exc,
+            )
+            if tmp_filename is not None:
+                try:
+                    os.remove(tmp_filename)
+                except OSError:
+                    pass
+
+        return test_env
+
     def probe(self,
               testsuite: TestsuiteCore,
               dirpath: str,
@@ -90,7 +212,7 @@ class YAMLTestFinder(TestFinder):
 
         # Load the YAML file to build the test environment
         try:
-            test_env = e3.yaml.load_with_config(yaml_file, Env().to_dict())
+            test_env = self.load_test_env(testsuite, yaml_file)
         except e3.yaml.YamlError:
             raise ProbingError(
                 "invalid syntax for test.yaml in '{}'".format(test_name)
@@ -133,6 +255,11 @@ class AdaCoreLegacyTestFinder(TestFinder):
         """
         self.driver_cls = driver_cls
 
+    @property
+    def thread_safe(self) -> bool:
+        # Subclasses that override probe have to opt in for parallel probing
+        return type(self).probe is AdaCoreLegacyTestFinder.probe
+
     def probe(self,
               testsuite: TestsuiteCore,
               dirpath: str,
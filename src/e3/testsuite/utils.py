@@ -1,7 +1,13 @@
 """Miscellaneous helpers."""
 
+from __future__ import annotations
+
 import sys
-from typing import AnyStr, IO, Optional
+from typing import AnyStr, Dict, IO, Optional, TYPE_CHECKING
+
+
+if TYPE_CHECKING:  # no cover
+    from e3.testsuite.result import TestStatus
 
 
 def isatty(stream: IO[AnyStr]) -> bool:
@@ -39,8 +45,14 @@ class ColorConfig:
         self.Fore = Fore
         self.Style = Style
 
+        self.status_colors: Dict[TestStatus, str] = {}
+        """
+        Cache for TestStatus.color: map test statuses to their color codes.
+        """
+
         if colors_enabled is None:
             colors_enabled = isatty(sys.stdout)
+        self.enabled = colors_enabled
 
         if not colors_enabled:
             self.Fore = DummyColors()
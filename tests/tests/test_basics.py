@@ -5,19 +5,32 @@ This checks the behavior of the Testsuite, TestDriver and BasicTestDriver
 classes.
 """
 
+import argparse
 import glob
 import logging
 import os
+import pickle
+import threading
+import time
 import warnings
 
 import yaml
 
+from e3.collection.dag import DAG
+from e3.env import BaseEnv
 from e3.testsuite import TestAbort as E3TestAbort
 from e3.testsuite import Testsuite as Suite
+from e3.testsuite import testcase_finder
 from e3.testsuite.driver import BasicTestDriver as BasicDriver
 from e3.testsuite.report.index import ReportIndex, ReportIndexEntry
 from e3.testsuite.result import TestResult as Result, TestStatus as Status
-from e3.testsuite.testcase_finder import TestFinder as Finder, ParsedTest
+from e3.testsuite.utils import DummyColors
+from e3.testsuite.testcase_finder import (
+    TestFinder as Finder,
+    ParsedTest,
+    ProbingError,
+    YAMLTestFinder,
+)
 
 from .utils import (
     extract_results,
@@ -141,6 +154,42 @@ def test_invalid_filter_pattern(caplog):
     )
 
 
+def test_filter_patterns():
+    """Check test filtering with literal and regexp patterns."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            pass
+
+        def analyze(self, prev, slot):
+            self.result.set_status(Status.PASS)
+            self.push_result()
+
+    class Mysuite(Suite):
+        tests_subdir = "simple-tests"
+        test_driver_map = {"default": MyDriver}
+        default_driver = "default"
+
+    def check(args, expected):
+        suite = run_testsuite(Mysuite, args=args)
+        assert sorted(extract_results(suite)) == sorted(expected)
+        assert suite.total_test == len(expected)
+
+        # Testcases must be registered in the command-line order
+        assert [t.test_name for t in suite.test_list] == expected
+
+    test1_dir = os.path.join(
+        os.path.dirname(__file__), "simple-tests", "test1"
+    )
+
+    check(["test1"], ["test1"])
+    check(["test[2]"], ["test2"])
+    check(["no-such-test"], [])
+    check(["test1", "test1", "t.st"], ["test1", "test2"])
+    check(["test2", "test[1]"], ["test2", "test1"])
+    check(["test2", test1_dir], ["test2", "test1"])
+
+
 def test_dump_environ():
     """Check that --dump-environ works (at least does not crash)."""
 
@@ -159,7 +208,36 @@ def test_dump_environ():
         test_driver_map = {"default": MyDriver}
         default_driver = "default"
 
+    os.environ["E3_TESTSUITE_DUMMY"] = "foo bar"
     run_testsuite(Mysuite, args=["--dump-environ"])
+    with open(os.path.join("out", "new", "environ.sh")) as f:
+        lines = f.read().splitlines()
+    assert "export E3_TESTSUITE_DUMMY='foo bar'" in lines
+
+
+def test_dump_dag():
+    """Check that tests.dot is created only when --dump-dag is passed."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            pass
+
+        def analyze(self, prev, slot):
+            self.result.set_status(Status.PASS)
+            self.push_result()
+
+    class Mysuite(Suite):
+        tests_subdir = "simple-tests"
+        test_driver_map = {"default": MyDriver}
+        default_driver = "default"
+
+    dot_file = os.path.join("out", "new", "tests.dot")
+    run_testsuite(Mysuite)
+    assert not os.path.exists(dot_file)
+
+    run_testsuite(Mysuite, args=["--dump-dag"])
+    with open(dot_file) as f:
+        assert "test1.run" in f.read()
 
 
 def test_no_testcase(caplog):
@@ -364,6 +442,31 @@ def test_missing_driver(caplog):
     assert "missing driver for test 'valid'" in logs
 
 
+def test_add_test_outside_main():
+    """Check that add_test can be called without running testsuite_main."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            pass
+
+        def analyze(self, prev, slot):
+            pass
+
+    suite = Suite()
+    suite.Fore = suite.Style = DummyColors()
+    suite.env = BaseEnv.from_env()
+    suite.env.working_dir = os.path.abspath("work")
+    suite.env.options = argparse.Namespace()
+
+    dag = DAG()
+    test_dir = os.path.abspath("test1")
+    assert suite.add_test(dag, ParsedTest("test1", MyDriver, {}, test_dir))
+    driver, _ = dag.vertex_data["test1.run"]
+    assert driver.test_env["working_dir"] == os.path.join(
+        os.path.abspath("work"), "test1"
+    )
+
+
 def test_invalid_driver(caplog):
     """Check that faulty driver classes are properly reported."""
 
@@ -377,8 +480,14 @@ def test_invalid_driver(caplog):
         default_driver = "default"
 
     run_testsuite(Mysuite, expect_failure=True)
-    logs = testsuite_logs(caplog)
-    assert any("Traceback:" in message for message in logs)
+    records = [
+        r
+        for r in caplog.records
+        if r.name == "testsuite"
+        and r.getMessage() == "cannot instantiate the driver for test 'test1'"
+    ]
+    assert len(records) == 1
+    assert records[0].exc_info is not None
 
 
 def test_show_error_output(caplog):
@@ -733,3 +842,295 @@ def test_multiple_tests_per_dir():
         "foo__b": Status.PASS,
         "foo__c": Status.PASS,
     }
+
+
+def test_result_write_error(caplog):
+    """Check that errors when writing test results are reported."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            pass
+
+        def analyze(self, prev, slot):
+            self.result.set_status(Status.PASS)
+            if self.test_name == "test2":
+                self.result.info["unserializable"] = object()
+            self.push_result()
+
+    class Mysuite(Suite):
+        tests_subdir = "simple-tests"
+        test_driver_map = {"default": MyDriver}
+        default_driver = "default"
+
+    suite, status = run_testsuite_status(Mysuite)
+    assert status == 1
+    assert not suite._result_writer.is_alive()
+    assert "cannot write the result for test2" in testsuite_logs(caplog)
+
+    # Results that cannot be serialized must be replaced with errors, both in
+    # the report index and on disk.
+    expected = {"test1": Status.PASS, "test2": Status.ERROR}
+    assert extract_results(suite) == expected
+    check_results_dir(new=expected)
+    index = ReportIndex.read(os.path.join("out", "new"))
+    result = index.entries["test2"].load()
+    assert result.msg == "cannot serialize the test result"
+
+
+def test_result_mutated_after_push():
+    """Check that written results are not affected by later mutations."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            self.result.set_status(Status.PASS)
+            self.result.info["key"] = "before"
+            self.push_result()
+
+        def analyze(self, prev, slot):
+            # This runs after the result was collected: it must not affect
+            # the result written on disk.
+            self.result.info["key"] = "after"
+            self.result.status = Status.FAIL
+            self.test_env["key"] = "after"
+
+    class Mysuite(Suite):
+        tests_subdir = "simple-tests"
+        test_driver_map = {"default": MyDriver}
+        default_driver = "default"
+
+    run_testsuite(Mysuite, args=["test1"])
+    with open(os.path.join("out", "new", "test1.yaml")) as f:
+        result = yaml.safe_load(f)
+    assert result.status == Status.PASS
+    assert result.info["key"] == "before"
+    assert "key" not in result.env
+
+
+def test_test_env_cache():
+    """Check that changes in test.yaml files invalidate the cache."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            pass
+
+        def analyze(self, prev, slot):
+            self.result.set_status(Status[self.test_env["status"]])
+            self.push_result()
+
+    class Mysuite(Suite):
+        tests_subdir = os.path.abspath("cache-tests")
+        test_driver_map = {"default": MyDriver}
+        default_driver = "default"
+
+    def write_test(status):
+        with open(os.path.join("cache-tests", "test1", "test.yaml"), "w") as f:
+            f.write("status: {}\n".format(status))
+
+    os.makedirs(os.path.join("cache-tests", "test1"))
+    write_test("PASS")
+    suite = run_testsuite(Mysuite)
+    assert extract_results(suite) == {"test1": Status.PASS}
+    assert len(os.listdir(suite.test_env_cache_dir)) == 1
+
+    # Second run: the cache entry must be used. Make sure of it by modifying
+    # the entry content.
+    (cache_file,) = glob.glob(os.path.join(suite.test_env_cache_dir, "*"))
+    with open(cache_file, "rb") as f:
+        key, test_env = pickle.load(f)
+    test_env["status"] = "XPASS"
+    with open(cache_file, "wb") as f:
+        pickle.dump((key, test_env), f)
+    suite = run_testsuite(Mysuite)
+    assert extract_results(suite) == {"test1": Status.XPASS}
+
+    # Command-line arguments must not invalidate cache entries
+    for args in (["-j2"], ["test1"], ["-j3", "--dump-dag", "cache-tests"]):
+        suite = run_testsuite(Mysuite, args=args)
+        assert extract_results(suite) == {"test1": Status.XPASS}
+
+    # Modifying the test.yaml file must invalidate the cache entry, even if
+    # its size and modification time are preserved.
+    yaml_file = os.path.join("cache-tests", "test1", "test.yaml")
+    stat = os.stat(yaml_file)
+    write_test("FAIL")
+    os.utime(yaml_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(yaml_file).st_size == stat.st_size
+    suite = run_testsuite(Mysuite)
+    assert extract_results(suite) == {"test1": Status.FAIL}
+    assert len(os.listdir(suite.test_env_cache_dir)) == 1
+
+
+def test_test_env_cache_write_error(monkeypatch):
+    """Check that errors while writing the test.yaml cache are ignored."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            pass
+
+        def analyze(self, prev, slot):
+            self.result.set_status(Status.PASS)
+            self.push_result()
+
+    class Mysuite(Suite):
+        tests_subdir = "simple-tests"
+        test_driver_map = {"default": MyDriver}
+        default_driver = "default"
+
+    def check():
+        suite = run_testsuite(Mysuite, args=["-j2"])
+        assert extract_results(suite) == {
+            "test1": Status.PASS,
+            "test2": Status.PASS,
+        }
+        assert os.listdir(suite.test_env_cache_dir) == []
+
+    # Errors when writing cache files
+    def failing_replace(src, dst):
+        raise OSError("no space left on device")
+
+    with monkeypatch.context() as m:
+        m.setattr(testcase_finder.os, "replace", failing_replace)
+        check()
+
+    # Test environments that cannot be pickled: pickling objects such as locks
+    # raises a TypeError.
+    def failing_dump(obj, file):
+        raise TypeError("cannot pickle '_thread.lock' object")
+
+    with monkeypatch.context() as m:
+        m.setattr(testcase_finder.pickle, "dump", failing_dump)
+        check()
+
+
+def test_parallel_probing(caplog):
+    """Check that directories are probed in parallel when possible."""
+
+    class MyDriver(BasicDriver):
+        def run(self, prev, slot):
+            pass
+
+        def analyze(self, prev, slot):
+            self.result.set_status(Status.PASS)
+            self.push_result()
+
+    class RecordingFinder(Finder):
+        def __init__(self, thread_safe):
+            self._thread_safe = thread_safe
+            self.threads = set()
+
+        @property
+        def thread_safe(self):
+            return self._thread_safe
+
+        def probe(self, testsuite, dirpath, dirnames, filenames):
+            self.threads.add(threading.current_thread())
+
+            # Give other threads a chance to probe directories concurrently
+            time.sleep(0.01)
+
+            name = os.path.basename(dirpath)
+            if name == "error":
+                raise ProbingError("cannot probe 'error'")
+            elif not name.startswith("t"):
+                return None
+            return ParsedTest(
+                testsuite.test_name(dirpath), MyDriver, {}, dirpath
+            )
+
+    root = os.path.abspath("probing-tests")
+    for i in range(8):
+        os.makedirs(os.path.join(root, "t{}".format(i), "sub"))
+
+    def run(finder, expected_status=0):
+        class Mysuite(Suite):
+            tests_subdir = root
+            test_finders = [finder]
+
+        suite, status = run_testsuite_status(Mysuite, ["-j4"])
+        assert status == expected_status
+
+        # Tests must be registered in walk order
+        expected = [
+            suite.test_name(dirpath)
+            for dirpath, _, _ in os.walk(root)
+            if os.path.basename(dirpath).startswith("t")
+        ]
+        assert [t.test_name for t in suite.test_list] == expected
+        assert extract_results(suite) == {n: Status.PASS for n in expected}
+
+    # Thread safe finder: several threads must be used
+    finder = RecordingFinder(thread_safe=True)
+    run(finder)
+    assert len(finder.threads) > 1
+
+    # Non thread safe finders must always be called from the main thread
+    finder = RecordingFinder(thread_safe=False)
+    run(finder)
+    assert finder.threads == {threading.main_thread()}
+
+    # Likewise for testsuites that override test_name without opting in for
+    # parallel probing.
+    class CustomNameSuite(Suite):
+        tests_subdir = root
+
+        @property
+        def test_finders(self):
+            return [finder]
+
+        def test_name(self, test_dir):
+            return "custom-" + os.path.basename(test_dir)
+
+    class ThreadSafeCustomNameSuite(CustomNameSuite):
+        test_name_thread_safe = True
+
+    finder = RecordingFinder(thread_safe=True)
+    run_testsuite(CustomNameSuite, ["-j4"])
+    assert finder.threads == {threading.main_thread()}
+
+    finder = RecordingFinder(thread_safe=True)
+    run_testsuite(ThreadSafeCustomNameSuite, ["-j4"])
+    assert len(finder.threads) > 1
+
+    # Unexpected errors must not wait for all pending probes
+    class CrashingFinder(RecordingFinder):
+        def __init__(self):
+            super().__init__(thread_safe=True)
+            self.calls = 0
+
+        def probe(self, testsuite, dirpath, dirnames, filenames):
+            self.calls += 1
+            if dirpath == root:
+                raise RuntimeError("probe crash")
+            return super().probe(testsuite, dirpath, dirnames, filenames)
+
+    class CrashingSuite(Suite):
+        tests_subdir = root
+        test_finders = [CrashingFinder()]
+
+    try:
+        run_testsuite_status(CrashingSuite, ["-j4"])
+    except RuntimeError as exc:
+        assert str(exc) == "probe crash"
+    else:
+        assert False, "RuntimeError expected"
+    assert CrashingSuite.test_finders[0].calls < len(list(os.walk(root)))
+
+    # Probing errors in worker threads must be reported
+    os.makedirs(os.path.join(root, "error"))
+    run(RecordingFinder(thread_safe=True), expected_status=1)
+    assert "cannot probe 'error'" in testsuite_logs(caplog)
+
+
+def test_builtin_finders_thread_safety():
+    """Check that subclasses of builtin finders can opt out threading."""
+
+    class MyFinder(YAMLTestFinder):
+        def probe(self, testsuite, dirpath, dirnames, filenames):
+            return super().probe(testsuite, dirpath, dirnames, filenames)
+
+    class MyThreadSafeFinder(MyFinder):
+        thread_safe = True
+
+    assert YAMLTestFinder().thread_safe
+    assert not MyFinder().thread_safe
+    assert MyThreadSafeFinder().thread_safe
@@ -70,6 +70,9 @@ def test_control_interpret():
         "entry #1: invalid condition (NameError):"
         " name 'foobar' is not defined"
     )
+    assert expect_error({"control": [["SKIP", "1 +"]]}).startswith(
+        "entry #1: invalid condition (SyntaxError):"
+    )
 
     # Precedence to the first control whose condition is true
     assert (